@@ -0,0 +1,81 @@
+import os
+import random
+import struct
+import sys
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("piexif")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import watermarker_1 as wm  # noqa: E402
+
+DATE = b"2021:07:04 12:34:56\x00"
+MAKE_TAG = 0x010F  # sorts before DateTime, so the DateTime entry is not the first one
+ORIENTATION_TAG = 0x0112
+
+
+def make_tiff(byte_order: bytes, value: bytes) -> bytes:
+    """IFD0 with Make, Orientation and DateTime; values over 4 bytes go after the IFD"""
+    endian = "<" if byte_order == b"II" else ">"
+    header = byte_order + struct.pack(endian + "HI", 42, 8)
+    entries = [(MAKE_TAG, b"Cam\x00"), (ORIENTATION_TAG, b"\x00\x01\x00\x00"), (wm.EXIF_DATETIME_TAG, value)]
+    data_start = 8 + 2 + len(entries) * 12 + 4
+    ifd = struct.pack(endian + "H", len(entries))
+    data = b""
+    for tag, raw in entries:
+        if len(raw) <= 4:
+            ifd += struct.pack(endian + "HHI", tag, 2, len(raw)) + raw.ljust(4, b"\x00")
+        else:
+            ifd += struct.pack(endian + "HHII", tag, 2, len(raw), data_start + len(data))
+            data += raw
+    return header + ifd + struct.pack(endian + "I", 0) + data
+
+
+def make_jpeg(tiff=None) -> bytes:
+    app0 = b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    buf = b"\xff\xd8" + b"\xff\xe0" + struct.pack(">H", 2 + len(app0)) + app0
+    if tiff is not None:
+        payload = wm.EXIF_HEADER + tiff
+        buf += b"\xff\xe1" + struct.pack(">H", 2 + len(payload)) + payload
+    return buf + b"\xff\xda\x00\x08" + b"\x00" * 16 + b"\xff\xd9"
+
+
+@pytest.mark.parametrize("byte_order", [b"II", b"MM"])
+def test_datetime_stored_at_offset(byte_order):
+    assert wm._tiff_datetime(make_tiff(byte_order, DATE)) == "2021:07:04 12:34:56"
+    assert wm._parse_jpeg_datetime(make_jpeg(make_tiff(byte_order, DATE))) == "2021:07:04 12:34:56"
+
+
+@pytest.mark.parametrize("byte_order", [b"II", b"MM"])
+def test_datetime_stored_inline(byte_order):
+    assert wm._tiff_datetime(make_tiff(byte_order, b"abc\x00")) == "abc"
+    assert wm._parse_jpeg_datetime(make_jpeg(make_tiff(byte_order, b"abcd"))) == "abcd"
+
+
+def test_tiff_start_offset_is_honoured():
+    buf = b"junk" + make_tiff(b"MM", DATE)
+    assert wm._tiff_datetime(buf, 4) == "2021:07:04 12:34:56"
+
+
+def test_missing_exif():
+    assert wm._parse_jpeg_datetime(make_jpeg()) is None
+    assert wm._parse_jpeg_datetime(b"\x89PNG\r\n\x1a\n" + b"\x00" * 32) is None
+    assert wm._tiff_datetime(b"XX*\x00" + b"\x00" * 16) is None
+
+
+@pytest.mark.parametrize("byte_order", [b"II", b"MM"])
+def test_truncated_input_returns_none(byte_order):
+    full = make_jpeg(make_tiff(byte_order, DATE))
+    tiff_end = full.index(b"\xff\xda")
+    for n in range(tiff_end - 1):
+        assert wm._parse_jpeg_datetime(full[:n]) is None, n
+
+
+def test_garbage_input_returns_none():
+    rng = random.Random(0)
+    for _ in range(200):
+        garbage = bytes(rng.getrandbits(8) for _ in range(rng.randrange(0, 256)))
+        assert wm._tiff_datetime(b"II" + garbage) is None
+        assert wm._parse_jpeg_datetime(b"\xff\xd8" + garbage) is None
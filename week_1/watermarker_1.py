@@ -1,101 +1,431 @@
+from __future__ import annotations
+
+import argparse
+import functools
+import io
+import math
+import mmap
 import os
-from PIL import Image, ImageDraw, ImageFont
-import piexif
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from PIL import Image, ImageDraw, ImageFont, features
+import piexif  # type: ignore[import-untyped]
+
+FONT_PATH = "arial.ttf"
+IMAGE_EXTS = {".jpg", ".jpeg"}
+OUTPUT_DIR_NAME = "_watermark"
+JPEG_QUALITY = 85
+MARGIN = 10
 
+# 水印位置 -> 左上角坐标 (图片宽, 图片高, 文本宽, 文本高)
+PositionFn = Callable[[int, int, int, int], Tuple[int, int]]
+POSITIONS: Dict[str, PositionFn] = {
+    "top_left": lambda w, h, tw, th: (MARGIN, MARGIN),
+    "top_center": lambda w, h, tw, th: ((w - tw) >> 1, MARGIN),
+    "top_right": lambda w, h, tw, th: (w - tw - MARGIN, MARGIN),
+    "center": lambda w, h, tw, th: ((w - tw) >> 1, (h - th) >> 1),
+    "bottom_left": lambda w, h, tw, th: (MARGIN, h - th - MARGIN),
+    "bottom_center": lambda w, h, tw, th: ((w - tw) >> 1, h - th - MARGIN),
+    "bottom_right": lambda w, h, tw, th: (w - tw - MARGIN, h - th - MARGIN),
+    "left_center": lambda w, h, tw, th: (MARGIN, (h - th) >> 1),
+    "right_center": lambda w, h, tw, th: (w - tw - MARGIN, (h - th) >> 1),
+}
 
-def get_image_exif_date(image_path):
-    """提取图片的EXIF拍摄时间"""
-    exif_dict = piexif.load(image_path)
+@functools.lru_cache(maxsize=32)
+def get_font(font_path: str, font_size: int) -> Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]:
+    """加载字体，同一进程内相同 (字体路径, 字号) 只加载一次"""
     try:
+        return ImageFont.truetype(font_path, font_size)
+    except IOError:
+        return ImageFont.load_default()
+
+
+@functools.lru_cache(maxsize=256)
+def get_text_size(text: str, font_path: str, font_size: int) -> Tuple[int, int]:
+    """计算文本宽高；同一批照片的日期和字号大量重复，结果可直接复用
+
+    使用前进宽度和字体上下行高度，无需像 textbbox 那样遍历字形轮廓。
+    """
+    font = get_font(font_path, font_size)
+    if not hasattr(font, "getmetrics"):  # 旧版 Pillow 的位图默认字体
+        bbox = font.getbbox(text)
+        return bbox[2], bbox[3]
+    ascent, descent = font.getmetrics()
+    return math.ceil(font.getlength(text)), ascent + descent
+
+
+@functools.lru_cache(maxsize=64)
+def get_text_mask(text: str, font_path: str, font_size: int) -> Tuple[Image.Image, Tuple[int, int]]:
+    """把水印文字预先渲染成单通道覆盖率蒙版（L模式），同样的日期只光栅化一次
+
+    蒙版与颜色无关，合成时直接用纯色透过蒙版填充，一次遍历完成混合。
+    蒙版裁剪到有笔画的区域（去掉行高留白等全透明像素），返回 (蒙版, 相对文本框左上角的偏移)。
+    """
+    text_width, text_height = get_text_size(text, font_path, font_size)
+    mask = Image.new("L", (max(1, text_width), max(1, text_height)), 0)
+    ImageDraw.Draw(mask).text((0, 0), text, fill=255, font=get_font(font_path, font_size))
+    ink = mask.getbbox()
+    if ink is None:  # 空文本
+        return mask, (0, 0)
+    return mask.crop(ink), (ink[0], ink[1])
+
+
+# 文字戳：(文本宽高, 蒙版, 蒙版偏移)
+TextStamp = Tuple[Tuple[int, int], Image.Image, Tuple[int, int]]
+# 主进程预先渲染、在工作进程启动时传入的文字戳，键为 (文本, 字体路径, 字号)
+_PRELOADED_STAMPS: Dict[Tuple[str, str, int], TextStamp] = {}
+
+
+def get_text_stamp(text: str, font_path: str, font_size: int) -> TextStamp:
+    """取得文字戳：优先使用主进程预渲染的结果，工作进程无需再加载字体"""
+    stamp = _PRELOADED_STAMPS.get((text, font_path, font_size))
+    if stamp is None:
+        mask, offset = get_text_mask(text, font_path, font_size)
+        stamp = (get_text_size(text, font_path, font_size), mask, offset)
+    return stamp
+
+
+def _init_worker(stamps: Dict[Tuple[str, str, int], TextStamp]) -> None:
+    """工作进程初始化：接收主进程渲染好的文字戳（每个进程只传一次）"""
+    _PRELOADED_STAMPS.update(stamps)
+
+
+EXIF_DATETIME_TAG = 0x0132  # IFD0 DateTime
+EXIF_HEADER = b"Exif\x00\x00"
+JPEG_SCAN_BYTES = 64 * 1024
+
+
+def _tiff_datetime(buf: bytes, tiff_start: int = 0) -> Optional[str]:
+    """在TIFF结构的IFD0中查找DateTime标签，返回原始字符串或None"""
+    mv = memoryview(buf)
+    byte_order = bytes(mv[tiff_start:tiff_start + 2])
+    if byte_order == b"II":
+        endian = "<"
+    elif byte_order == b"MM":
+        endian = ">"
+    else:
+        return None
+    # 截断或损坏的数据一律返回 None，不向调用方抛出 struct.error
+    try:
+        ifd_offset, = struct.unpack_from(endian + "I", mv, tiff_start + 4)
+        ifd_start = tiff_start + ifd_offset
+        count, = struct.unpack_from(endian + "H", mv, ifd_start)
+        entries = mv[ifd_start + 2:ifd_start + 2 + count * 12]
+        # 每个IFD条目12字节：tag, type, count, value/offset
+        for i, (tag, _, length, value) in enumerate(struct.iter_unpack(endian + "HHII", entries)):
+            if tag == EXIF_DATETIME_TAG:
+                if length <= 4:
+                    start = ifd_start + 2 + i * 12 + 8
+                else:
+                    start = tiff_start + value
+                raw = bytes(mv[start:start + length])
+                if len(raw) < length:
+                    return None
+                return raw.split(b"\x00", 1)[0].decode("ascii")
+            if tag > EXIF_DATETIME_TAG:  # 条目按tag升序排列
+                break
+    except (struct.error, UnicodeDecodeError):
+        return None
+    return None
+
+
+def _parse_jpeg_datetime(buf: bytes) -> Optional[str]:
+    """遍历JPEG段找到APP1(Exif)，再解析其中的DateTime"""
+    if buf[:2] != b"\xff\xd8":
+        return None
+    off = 2
+    end = len(buf)
+    while off + 4 <= end:
+        if buf[off] != 0xFF:
+            return None
+        marker = buf[off + 1]
+        if marker == 0xFF:  # 填充字节
+            off += 1
+            continue
+        if marker in (0xDA, 0xD9):  # 图像数据开始/结束，不会再有APP1
+            return None
+        seg_len, = struct.unpack_from(">H", buf, off + 2)
+        if marker == 0xE1 and buf[off + 4:off + 10] == EXIF_HEADER:
+            return _tiff_datetime(buf, off + 10)
+        off += 2 + seg_len
+    return None
+
+
+def _read_jpeg_datetime(image_path: str) -> Optional[str]:
+    """只读取文件开头若干KB，直接从APP1段解析DateTime
+
+    注：只处理 JPEG。collect_images 只收集 IMAGE_EXTS 中的 JPEG，Pillow 也无法直接打开 HEIC，
+    因此不做 HEIC/HEIF 的日期读取。
+    """
+    with open(image_path, "rb") as f:
+        buf = f.read(JPEG_SCAN_BYTES)
+    try:
+        return _parse_jpeg_datetime(buf)
+    except (struct.error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _format_exif_date(date_time: str) -> str:
+    """将 "YYYY:MM:DD HH:MM:SS" 格式转换为 YYYY-MM-DD"""
+    date = date_time.split(' ')[0]
+    return date.replace(":", "-")
+
+
+def get_image_exif_date(image_path: str, img: Optional[Image.Image] = None) -> Optional[str]:
+    """提取图片的EXIF拍摄时间
+
+    优先直接解析APP1段中的 DateTime；其次用 Pillow 只读取该标签（不解码像素）；
+    最后回退到 piexif 完整解析。传入已打开的 img 可避免重复读取文件。
+    """
+    try:
+        if img is None:
+            date_time = _read_jpeg_datetime(image_path)
+        else:
+            # Pillow 打开时已把APP1内容读入 info["exif"]，直接解析即可
+            exif = img.info.get("exif", b"")
+            date_time = _tiff_datetime(exif, len(EXIF_HEADER)) if exif.startswith(EXIF_HEADER) else None
+        if date_time:
+            return _format_exif_date(date_time)
+    except (OSError, struct.error, UnicodeDecodeError):
+        pass
+
+    try:
+        if img is None:
+            with Image.open(image_path) as im:
+                date_time = im.getexif().get(EXIF_DATETIME_TAG)
+        else:
+            date_time = img.getexif().get(EXIF_DATETIME_TAG)
+        if date_time:
+            if isinstance(date_time, bytes):
+                date_time = date_time.decode('utf-8')
+            return _format_exif_date(date_time)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        exif_dict = piexif.load(image_path)
         # 获取拍摄时间（EXIF的DateTime字段）
         date_time = exif_dict['0th'][piexif.ImageIFD.DateTime].decode('utf-8')
         # 格式为 "YYYY:MM:DD HH:MM:SS"，提取年月日
-        date = date_time.split(' ')[0]
-        return date.replace(":", "-")  # 格式为 "YYYY-MM-DD"
-    except (KeyError, ValueError):
+        return _format_exif_date(date_time)  # 格式为 "YYYY-MM-DD"
+    except (KeyError, ValueError, piexif.InvalidImageDataError):
         print("无法获取EXIF信息中的拍摄时间。")
         return None
 
 
-def add_watermark(image_path, watermark_text, font_size=30, font_color=(255, 255, 255), position="center"):
-    """将水印添加到图片中并保存"""
-    # 打开图片
-    img = Image.open(image_path)
-    draw = ImageDraw.Draw(img)
+def add_watermark(image_path: str, watermark_text: str, font_size: int = 30,
+                  font_color: Tuple[int, int, int] = (255, 255, 255), position: str = "center",
+                  img: Optional[Image.Image] = None, max_dim: Optional[int] = None, keep_quality: bool = False,
+                  out_dir: Optional[str] = None) -> str:
+    """将水印添加到图片中并保存（可传入已打开的 img 复用）
 
-    # 设置字体和字体大小
-    try:
-        font = ImageFont.truetype("arial.ttf", font_size)
-    except IOError:
-        font = ImageFont.load_default()
+    out_dir 为输出目录，批量处理时由调用方预先创建；未指定时使用原目录下的 _watermark 目录。
+
+    指定 max_dim 时输出缩小到长边不超过 max_dim：JPEG 先在解码阶段按 1/2、1/4、1/8 缩放（draft），
+    再用 thumbnail 精确缩放，水印位置按缩小后的尺寸计算。
+    keep_quality 为 True 时沿用原JPEG的量化表和色度采样，未被水印覆盖的区域几乎不产生二次压缩损失。
+    """
+    # 打开图片
+    if img is None:
+        img = Image.open(image_path)
+    src_format = img.format
+    if max_dim:
+        if src_format == "JPEG":
+            img.draft("RGB", (max_dim * 2, max_dim * 2))
+        img.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    # 灰度/CMYK/调色板等模式统一转为 RGB(A)：颜色元组与通道一致，
+    # 且 Pillow 对每像素4字节的打包格式按整字做混合
+    if img.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
 
     # 获取图片的大小
     img_width, img_height = img.size
 
-    # 获取水印文本的大小（通过文本边界框）
-    bbox = draw.textbbox((0, 0), watermark_text, font=font)
-    text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    # 获取水印文本的大小和预渲染的蒙版
+    (text_width, text_height), mask, (dx, dy) = get_text_stamp(watermark_text, FONT_PATH, font_size)
 
     # 计算水印的位置
-    if position == "top_left":
-        position = (10, 10)
-    elif position == "top_center":
-        position = ((img_width - text_width) / 2, 10)
-    elif position == "top_right":
-        position = (img_width - text_width - 10, 10)
-    elif position == "center":
-        position = ((img_width - text_width) / 2, (img_height - text_height) / 2)
-    elif position == "bottom_left":
-        position = (10, img_height - text_height - 10)
-    elif position == "bottom_center":
-        position = ((img_width - text_width) / 2, img_height - text_height - 10)
-    elif position == "bottom_right":
-        position = (img_width - text_width - 10, img_height - text_height - 10)
-    elif position == "left_center":
-        position = (10, (img_height - text_height) / 2)
-    elif position == "right_center":
-        position = (img_width - text_width - 10, (img_height - text_height) / 2)
-    else:
+    position_fn = POSITIONS.get(position)
+    if position_fn is None:
         print("未知位置，使用默认位置: center")
-        position = ((img_width - text_width) / 2, (img_height - text_height) / 2)
+        position_fn = POSITIONS["center"]
+    x, y = position_fn(img_width, img_height, text_width, text_height)
 
-    # 添加水印
-    draw.text(position, watermark_text, fill=font_color, font=font)
+    # 添加水印：用字体颜色透过预渲染的蒙版填充到原图上
+    x, y = x + dx, y + dy
+    img.paste(font_color, (x, y, x + mask.width, y + mask.height), mask)
 
     # 获取目录路径和创建新目录
-    dir_path = os.path.dirname(image_path)
-    new_dir = os.path.join(dir_path, "_watermark")
-    if not os.path.exists(new_dir):
-        os.makedirs(new_dir)
+    if out_dir is None:
+        out_dir = output_dir_for(image_path)
+        os.makedirs(out_dir, exist_ok=True)
 
     # 保存新图片
     base_name = os.path.basename(image_path)
-    new_image_path = os.path.join(new_dir, f"watermarked_{base_name}")
-    img.save(new_image_path)
+    new_image_path = os.path.join(out_dir, f"watermarked_{base_name}")
+    # 先编码到内存，再一次性写入文件
+    buf = io.BytesIO()
+    if src_format == "JPEG":
+        # 优化哈夫曼表 + 渐进式编码，输出更小；保留EXIF使拍摄时间不丢失
+        quality: Union[int, str]
+        subsampling: Union[int, str]
+        if keep_quality and hasattr(img, "quantization"):  # 模式转换后已不是原JPEG对象，无法沿用量化表
+            quality, subsampling = "keep", "keep"
+        else:
+            quality, subsampling = JPEG_QUALITY, 2
+        img.save(buf, "JPEG", quality=quality, optimize=True, progressive=True,
+                 subsampling=subsampling, exif=img.info.get("exif", b""))
+    else:
+        img.save(buf, src_format)
+    write_file(new_image_path, buf.getbuffer())
 
     print(f"水印已添加并保存为: {new_image_path}")
+    return new_image_path
+
+
+def write_file(path: str, data: Union[bytes, memoryview]) -> None:
+    """用 os.write 直接写入整个缓冲区（绕过 Python 的缓冲文件对象）"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
 
 
-def main():
-    # 用户输入图片路径
-    image_path = input("请输入图片文件路径：").strip()
+def output_dir_for(image_path: str) -> str:
+    """图片对应的输出目录：原目录下的 _watermark 子目录"""
+    return os.path.join(os.path.dirname(image_path), OUTPUT_DIR_NAME)
 
-    # 提取拍摄时间
-    watermark_text = get_image_exif_date(image_path)
-    if not watermark_text:
-        print("未能获取拍摄时间，无法生成水印。")
+
+def collect_images(input_path: str) -> List[Path]:
+    """收集输入路径下的所有图片（跳过已生成的水印目录）"""
+    path = Path(input_path)
+    if path.is_file():
+        return [path]
+    return sorted(
+        p for p in path.rglob("*")
+        if p.suffix.lower() in IMAGE_EXTS and OUTPUT_DIR_NAME not in p.parts
+    )
+
+
+@dataclass
+class BatchPlan:
+    """批量任务的按列存储：同一下标对应同一张图片
+
+    在主进程中一次性扫描所有文件头得到拍摄日期，再按日期分组提交，
+    使同一日期的文字蒙版在工作进程中被连续复用。
+    """
+    paths: List[str] = field(default_factory=list)
+    dates: List[Optional[str]] = field(default_factory=list)
+    out_dirs: List[str] = field(default_factory=list)
+
+    @classmethod
+    def build(cls, image_paths: List[Path]) -> BatchPlan:
+        plan = cls()
+        for p in image_paths:
+            path = str(p)
+            plan.paths.append(path)
+            plan.dates.append(get_image_exif_date(path))
+            plan.out_dirs.append(output_dir_for(path))
+        return plan
+
+    def missing(self) -> List[int]:
+        """没有拍摄日期的图片下标"""
+        return [i for i, d in enumerate(self.dates) if not d]
+
+    def groups(self) -> Dict[str, List[int]]:
+        """按日期分组：{日期: [下标, ...]}，按日期排序"""
+        groups: Dict[str, List[int]] = {}
+        for i, d in enumerate(self.dates):
+            if d:
+                groups.setdefault(d, []).append(i)
+        return dict(sorted(groups.items()))
+
+
+def process_image(image_path: str, watermark_text: str, out_dir: str, font_size: int,
+                  font_color: Tuple[int, int, int], position: str, max_dim: Optional[int] = None,
+                  keep_quality: bool = False) -> str:
+    """处理单张图片：添加水印并保存（在工作进程中执行）"""
+    # 内存映射文件后交给 Pillow 打开
+    # （Image 为惰性解码，像素读取和保存都在映射关闭前完成）
+    with open(image_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            Image.open(mm) as img:  # type: ignore[arg-type]  # mmap 是类文件对象
+        return add_watermark(image_path, watermark_text, font_size, font_color, position,
+                             img=img, max_dim=max_dim, keep_quality=keep_quality, out_dir=out_dir)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="为图片批量添加拍摄日期水印")
+    parser.add_argument("--input-dir", required=True, help="图片文件或目录路径")
+    parser.add_argument("--font-size", type=int, default=30, help="字体大小（例如：30）")
+    parser.add_argument("--color", default="255,255,255", help="字体颜色（R,G,B,例如：255,255,255）")
+    parser.add_argument("--position", default="center",
+                        help="水印位置（" + ", ".join(POSITIONS) + "）")
+    parser.add_argument("--max-dim", type=int, default=None,
+                        help="输出图片长边的最大像素数（用于网页预览等），JPEG 会在解码时直接缩放")
+    parser.add_argument("--keep-quality", action="store_true",
+                        help="JPEG 沿用原图的量化表和色度采样，减少二次压缩损失")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="并行进程数")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    r, g, b = map(int, args.color.split(','))
+    font_color = (r, g, b)
+
+    # Pillow 官方 wheel 自带 libjpeg-turbo（SIMD 的 IDCT/颜色转换）；自行编译时可能链接了普通 libjpeg
+    if not features.check_feature("libjpeg_turbo"):
+        print("提示：当前 Pillow 未使用 libjpeg-turbo，JPEG 编解码会明显变慢，建议安装官方 wheel。")
+
+    image_paths = collect_images(args.input_dir)
+    if not image_paths:
+        print("未找到图片文件。")
         return
 
-    print(f"提取的拍摄时间为：{watermark_text}")
+    # 先扫描所有文件头得到拍摄日期
+    plan = BatchPlan.build(image_paths)
+    for i in plan.missing():
+        print(f"未能获取拍摄时间，跳过: {plan.paths[i]}")
+    groups = plan.groups()
+
+    # 输出目录在主进程中统一创建，每个目录只创建一次
+    for d in {plan.out_dirs[i] for indices in groups.values() for i in indices}:
+        os.makedirs(d, exist_ok=True)
+
+    # 每个日期的文字蒙版只在主进程渲染一次，随进程初始化分发给各工作进程
+    stamps = {(date, FONT_PATH, args.font_size): get_text_stamp(date, FONT_PATH, args.font_size)
+              for date in groups}
 
-    # 获取用户设置
-    font_size = int(input("请输入字体大小（例如：30）："))
-    font_color = input("请输入字体颜色（R,G,B,例如：255,255,255）：")
-    font_color = tuple(map(int, font_color.split(',')))
-    position = input("请输入水印位置（top_left, center, bottom_right）：").strip()
+    # 多进程并行处理，同一日期的图片连续提交
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(stamps,)) as executor:
+        futures = [
+            (plan.paths[i],
+             executor.submit(process_image, plan.paths[i], date, plan.out_dirs[i], args.font_size, font_color,
+                             args.position, args.max_dim, args.keep_quality))
+            for date, indices in groups.items()
+            for i in indices
+        ]
+        done = 0
+        for path, f in futures:
+            # 单张图片出错（如文件截断）只记为失败，不中断整批
+            try:
+                if f.result():
+                    done += 1
+            except Exception as e:
+                print(f"处理失败: {path}: {e}", file=sys.stderr)
 
-    # 添加水印
-    add_watermark(image_path, watermark_text, font_size, font_color, position)
+    print(f"处理完成：{done}/{len(image_paths)} 张图片已添加水印。")
 
 
 if __name__ == "__main__":
@@ -4,17 +4,24 @@
 
 from __future__ import annotations
 
+import functools
+import hashlib
 import json
 import math
 import os
+import queue
 import sys
+import threading
+import time
 import traceback
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, fields, replace
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from PySide6.QtCore import (
     Qt,
+    QBuffer,
+    QIODevice,
     QSize,
     QRect,
     QRectF,
@@ -22,7 +29,11 @@ from PySide6.QtCore import (
     QPointF,
     QMimeData,
     QDir,
+    QRunnable,
     QStandardPaths,
+    QStringListModel,
+    QThreadPool,
+    QTimer,
     Signal,
     QObject,
 )
@@ -33,6 +44,7 @@ from PySide6.QtGui import (
     QDropEvent,
     QFont,
     QFontDatabase,
+    QFontMetrics,
     QGuiApplication,
     QIcon,
     QImage,
@@ -97,10 +109,23 @@ def templates_dir() -> Path:
     return p
 
 
+def thumbs_dir() -> Path:
+    p = app_data_dir() / "thumbs"
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
 def last_settings_path() -> Path:
     return app_data_dir() / "last.json"
 
 
+def write_text_atomic(path: Path, text: str):
+    # write-then-rename so a crash mid-write never leaves a torn JSON file behind
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
 # -------- data model --------
 
 @dataclass
@@ -140,8 +165,8 @@ class WatermarkSettings:
     name_suffix: str = "_watermarked"
 
     def to_dict(self) -> Dict:
-        d = asdict(self)
-        return d
+        # all fields are JSON-native primitives/tuples: a shallow dict is enough (asdict deep-copies)
+        return {f.name: getattr(self, f.name) for f in fields(self)}
 
     @staticmethod
     def from_dict(d: Dict) -> "WatermarkSettings":
@@ -149,33 +174,54 @@ class WatermarkSettings:
         for k, v in d.items():
             if hasattr(obj, k):
                 setattr(obj, k, v)
+        # JSON turns the tuple into a list; keep every field immutable so shallow copies never share state
+        obj.pos_rel = (float(obj.pos_rel[0]), float(obj.pos_rel[1]))
         return obj
 
 
 # -------- image helpers --------
 
 SUPPORTED_READ = {fmt.data().decode("utf-8").lower() for fmt in QImageReader.supportedImageFormats()}
-VALID_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"} & {f".{e}" for e in SUPPORTED_READ}
+VALID_EXTS = frozenset({"jpg", "jpeg", "png", "bmp", "tif", "tiff"} & SUPPORTED_READ)  # no leading dot
 THUMB_SIZE = QSize(120, 120)
+THUMB_CACHE_MAX_FILES = 2000  # ~120px PNGs, a few tens of MB on disk
+EXPORT_ERRORS_SHOWN = 20  # failures listed in the summary dialog
+PREVIEW_MAX_SIDE = 1920  # why: preview never needs full-res pixels; export re-decodes from path
 
 
-def is_image_file(p: Path) -> bool:
-    return p.is_file() and p.suffix.lower() in VALID_EXTS
+def has_image_ext(name: str) -> bool:
+    # plain str ops: no Path/suffix objects per directory entry
+    _, dot, ext = name.rpartition(".")
+    return bool(dot) and ext.lower() in VALID_EXTS
 
 
-def enumerate_images(paths: List[Path]) -> List[Path]:
-    out: List[Path] = []
+def enumerate_images(paths: Iterable[Path]) -> Iterator[Path]:
+    # generator: callers can start adding items before a big tree is fully walked
     for path in paths:
         if path.is_file():
-            if is_image_file(path):
-                out.append(path)
+            if has_image_ext(path.name):  # already stat'ed above
+                yield path
         elif path.is_dir():
-            for root, _, files in os.walk(path):
-                for fn in files:
-                    fp = Path(root) / fn
-                    if is_image_file(fp):
-                        out.append(fp)
-    return out
+            yield from map(Path, scan_dir_images(str(path)))
+
+
+def scan_dir_images(root: str) -> Iterator[str]:
+    # os.scandir reuses the dirent type, so no extra stat per entry (unlike os.walk + is_file)
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif has_image_ext(entry.name) and entry.is_file():
+                yield entry.path  # plain str; callers build Path objects once per batch
+        stack.extend(reversed(subdirs))
 
 
 def load_qimage(path: Path) -> Optional[QImage]:
@@ -183,28 +229,501 @@ def load_qimage(path: Path) -> Optional[QImage]:
     img = reader.read()
     if img.isNull():
         return None
-    return img.convertToFormat(QImage.Format.Format_ARGB32)
+    return img.convertToFormat(blend_format(img))
+
+
+def blend_format(img: QImage) -> QImage.Format:
+    # opaque sources stay RGB32 (no per-pixel alpha work); anything with alpha uses Qt's native blend format
+    return QImage.Format.Format_ARGB32_Premultiplied if img.hasAlphaChannel() else QImage.Format.Format_RGB32
+
+
+def load_preview_qimage(path: Path, max_side: int = PREVIEW_MAX_SIDE) -> Optional[QImage]:
+    reader = QImageReader(str(path))
+    size = reader.size()
+    if size.isValid() and max(size.width(), size.height()) > max_side:
+        # let the decoder emit the target size directly (JPEG can use DCT scaling) instead of decoding every pixel
+        reader.setScaledSize(size.scaled(max_side, max_side, Qt.KeepAspectRatio))
+    img = reader.read()
+    if img.isNull():
+        return None
+    return img.convertToFormat(blend_format(img))
+
+
+def load_thumbnail(path: Path, size: QSize) -> Optional[QImage]:
+    # decode straight at thumbnail size (libjpeg scale_denom for JPEG) instead of full decode + scale
+    reader = QImageReader(str(path))
+    orig = reader.size()
+    if orig.isValid():
+        reader.setScaledSize(orig.scaled(size, Qt.KeepAspectRatio))
+    img = reader.read()
+    if img.isNull():
+        return None
+    # RGB32/premultiplied, so QPixmap.fromImage on the GUI thread is a plain upload
+    return img.convertToFormat(blend_format(img))
 
 
-def save_qimage(img: QImage, dest: Path, fmt: str, jpeg_quality: int) -> bool:
-    writer = QImageWriter(str(dest), fmt.encode("utf-8"))
+def thumb_cache_path(path: Path, size: QSize, cache_dir: Path) -> Optional[Path]:
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    key = hashlib.blake2b(f"{path}|{mtime_ns}|{size.width()}x{size.height()}".encode("utf-8"),
+                          digest_size=16).hexdigest()
+    return cache_dir / f"{key}.png"
+
+
+def load_cached_thumbnail(path: Path, size: QSize, cache_dir: Path) -> Optional[QImage]:
+    # re-importing a folder (or relaunching) costs a stat + small PNG read instead of a JPEG decode
+    cache_path = thumb_cache_path(path, size, cache_dir)
+    if cache_path is not None and cache_path.exists():
+        img = QImage(str(cache_path))
+        if not img.isNull():
+            try:
+                os.utime(cache_path)  # mark as recently used so prune_thumb_cache keeps it
+            except OSError:
+                pass
+            return img.convertToFormat(blend_format(img))
+    img = load_thumbnail(path, size)
+    if img is not None and cache_path is not None:
+        tmp = cache_path.with_name(f"{cache_path.stem}.{threading.get_ident()}.tmp")
+        # the cache is best-effort: a failed write (e.g. os.replace on Windows while another
+        # reader holds the target) still returns the decoded thumbnail
+        try:
+            if img.save(str(tmp), "PNG"):
+                os.replace(tmp, cache_path)
+        except OSError:
+            pass
+        finally:
+            try:
+                tmp.unlink(missing_ok=True)
+            except OSError:
+                pass
+    return img
+
+
+def prune_thumb_cache(cache_dir: Path, max_files: int = THUMB_CACHE_MAX_FILES):
+    # entries are keyed by (path, mtime), so edited or deleted photos leave orphans behind;
+    # keep the most recently used max_files and drop the rest (stray .tmp files included)
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+    excess = len(entries) - max_files
+    if excess <= 0:
+        return
+    entries.sort()
+    for _, p in entries[:excess]:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+
+@functools.lru_cache(maxsize=16)
+def decode_preview(path: str, mtime_ns: int) -> Optional[QImage]:
+    # preview-size copies only (export always re-reads full resolution)
+    return load_preview_qimage(Path(path))
+
+
+def decode_preview_path(path: Path) -> Optional[QImage]:
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return decode_preview(str(path), mtime_ns)
+
+
+@functools.lru_cache(maxsize=8)
+def load_logo_source(path: str, mtime_ns: int) -> Optional[QImage]:
+    # mtime_ns only feeds the cache key: replacing the logo file triggers a fresh decode
+    return load_qimage(Path(path))
+
+
+@functools.lru_cache(maxsize=8)
+def scaled_logo(path: str, mtime_ns: int, target_w: int, target_h: int) -> Optional[QImage]:
+    src = load_logo_source(path, mtime_ns)
+    if src is None:
+        return None
+    if src.width() == target_w and src.height() == target_h:
+        return src  # already 1:1, nothing to resample
+    return src.scaled(QSize(target_w, target_h), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+def encode_qimage(img: QImage, fmt: str, jpeg_quality: int) -> Optional[bytes]:
+    # encode in memory; the disk write is left to ExportWriter
+    buf = QBuffer()
+    buf.open(QIODevice.OpenModeFlag.WriteOnly)
+    writer = QImageWriter(buf, fmt.encode("utf-8"))
     if fmt.upper() == "JPEG":
         writer.setQuality(jpeg_quality)
-    return writer.write(img)
+    if not writer.write(img):
+        return None
+    return bytes(buf.data())
+
 
+@functools.lru_cache(maxsize=1)
+def font_families() -> Tuple[str, ...]:
+    # enumerating installed fonts is slow on Windows; do it once per process
+    return tuple(QFontDatabase.families())
 
+
+def watermark_transform(cx: float, cy: float, w: int, h: int, rotation: float, scale: float = 1.0) -> QTransform:
+    # maps watermark-local (0,0,w,h) so that its centre lands on (cx, cy), rotated by `rotation` degrees
+    t = QTransform()
+    t.translate(cx, cy)
+    t.rotate(rotation)
+    t.scale(scale, scale)
+    t.translate(-w / 2, -h / 2)
+    return t
+
+
+@functools.lru_cache(maxsize=256)
 def qcolor_from_rgba_str(s: str) -> QColor:
-    # Accept #RRGGBB or #RRGGBBAA
+    # Accept #RRGGBB or #RRGGBBAA; result is shared by the cache, callers only read it
     c = QColor(s)
     if not c.isValid():
         return QColor(255, 255, 255, 180)
     return c
 
 
+# -------- watermark rendering (QImage only, safe in worker threads) --------
+
+@functools.lru_cache(maxsize=64)
+def get_font(family: str, point: int, bold: bool, italic: bool) -> QFont:
+    # family lookup/substitution is resolved once per style, not per render
+    font = QFont(family, point)
+    font.setBold(bold)
+    font.setItalic(italic)
+    return font
+
+
+@functools.lru_cache(maxsize=256)
+def text_metrics(family: str, point: int, bold: bool, italic: bool, text: str) -> Tuple[int, int, int]:
+    # plain ints (w, h, descent) so the cache is safe to share with export worker threads
+    metrics = QFontMetrics(get_font(family, point, bold, italic))
+    br = metrics.boundingRect(text)
+    return br.width(), br.height(), metrics.descent()
+
+
+@functools.lru_cache(maxsize=32)
+def rasterize_text_wm(family: str, point: int, bold: bool, italic: bool, text: str,
+                      color_rgba: str, shadow_alpha: Optional[int]) -> QImage:
+    # pure function of the typography: every export worker and preview rebuild with the same style reuses it
+    font = get_font(family, point, bold, italic)
+    text_w, text_h, descent = text_metrics(family, point, bold, italic, text)
+    w = max(4, text_w + 16)
+    h = max(4, text_h + 16)
+    # draw text with optional shadow
+    img = QImage(w, h, QImage.Format.Format_ARGB32_Premultiplied)
+    img.fill(Qt.transparent)
+    painter = QPainter(img)
+    painter.setRenderHint(QPainter.Antialiasing, True)
+    painter.setFont(font)
+    col = qcolor_from_rgba_str(color_rgba)
+    if shadow_alpha is not None:
+        painter.setPen(QColor(0, 0, 0, shadow_alpha))
+        painter.drawText(9, h - descent - 7, text)
+    painter.setPen(col)
+    painter.drawText(8, h - descent - 8, text)
+    painter.end()
+    return img
+
+
+def render_text_watermark(st: WatermarkSettings) -> QImage:
+    # opacity only matters to the shadow alpha; without a shadow the painter applies it at draw time
+    shadow_alpha = int(0.5 * st.opacity * 2.55) if st.shadow else None
+    return rasterize_text_wm(st.font_family, st.font_point, st.font_bold, st.font_italic, st.text,
+                             st.color_rgba, shadow_alpha)
+
+
+def render_image_watermark(st: WatermarkSettings, base_size: QSize) -> Optional[QImage]:
+    if not st.image_path:
+        return None
+    try:
+        mtime_ns = os.stat(st.image_path).st_mtime_ns
+    except OSError:
+        return None
+    wm_img = load_logo_source(st.image_path, mtime_ns)
+    if wm_img is None or wm_img.isNull():
+        return None
+    # scale relative to shorter side of base image
+    short_side = min(base_size.width(), base_size.height())
+    scale_px = max(1, int(short_side * (st.image_scale_pct / 100.0)))
+    ratio = wm_img.width() / wm_img.height()
+    if wm_img.width() >= wm_img.height():
+        target_w = scale_px
+        target_h = int(target_w / ratio)
+    else:
+        target_h = scale_px
+        target_w = int(target_h * ratio)
+    return scaled_logo(st.image_path, mtime_ns, target_w, target_h)
+
+
+def render_watermark(st: WatermarkSettings, base_size: QSize) -> Optional[QImage]:
+    # single source of truth for preview and export; rotation/opacity are applied when drawing
+    if st.wm_type == "text":
+        return render_text_watermark(st)
+    return render_image_watermark(st, base_size)
+
+
+# -------- export pipeline --------
+
+def export_target_size(src: QSize, st: WatermarkSettings) -> QSize:
+    # output size after the optional resize; same size as src when nothing applies
+    w, h = src.width(), src.height()
+    if st.resize_mode == "none" or st.resize_value <= 0:
+        return QSize(src)
+    if st.resize_mode == "width" and st.resize_value < w:
+        box = QSize(st.resize_value, max(1, int(h * (st.resize_value / w))))
+    elif st.resize_mode == "height" and st.resize_value < h:
+        box = QSize(max(1, int(w * (st.resize_value / h))), st.resize_value)
+    elif st.resize_mode == "percent":
+        scale = max(1, st.resize_value) / 100.0
+        box = QSize(max(1, int(w * scale)), max(1, int(h * scale)))
+    else:
+        return QSize(src)
+    return src.scaled(box, Qt.KeepAspectRatio)
+
+
+def load_export_qimage(path: Path, st: WatermarkSettings) -> Tuple[Optional[QImage], QSize]:
+    # when exporting downscaled, let the decoder produce the target size directly (libjpeg DCT scaling)
+    # instead of decoding every full-resolution pixel and resampling afterwards; returns (image, original size)
+    reader = QImageReader(str(path))
+    orig = reader.size()
+    if orig.isValid():
+        target = export_target_size(orig, st)
+        if target.width() < orig.width():
+            reader.setScaledSize(target)
+    img = reader.read()
+    if img.isNull():
+        return None, orig
+    if not orig.isValid():
+        orig = img.size()
+    return img.convertToFormat(blend_format(img)), orig
+
+
+def compose_image(src_img: QImage, st: WatermarkSettings, src_size: Optional[QSize] = None) -> QImage:
+    # src_size: size of the original file when src_img was already decoded smaller (load_export_qimage)
+    if src_size is None:
+        src_size = src_img.size()
+    # optional resize
+    base = src_img
+    target = export_target_size(src_size, st)
+    if base.size() != target:
+        base = base.scaled(target, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    # watermark
+    if st.opacity <= 0:
+        return base
+    # text is defined in source pixels (same layer the preview downscales) and follows the resize factor;
+    # a logo is sized from the short side, so scale it straight to the output size (one resample, not two)
+    wm_base = base.size() if st.wm_type == "image" else src_size
+    wm = render_watermark(st, wm_base)
+    if wm is None:
+        return base
+    wm_scale = base.width() / max(1, wm_base.width())
+
+    # blend in place (src_img may be painted on when no resize happened): only the watermark footprint
+    # is touched, no full-frame canvas + copy
+    out = base
+    if out.format() != blend_format(out):
+        out = out.convertToFormat(blend_format(out))
+    painter = QPainter()
+    painter.begin(out)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+    cx = st.pos_rel[0] * base.width()
+    cy = st.pos_rel[1] * base.height()
+    painter.setTransform(watermark_transform(cx, cy, wm.width(), wm.height(), st.rotation, wm_scale))
+    painter.setOpacity(max(0.0, min(1.0, st.opacity / 100.0)))
+    painter.drawImage(0, 0, wm)
+    painter.end()
+    return out
+
+
+def compute_out_name(src: Path, st: WatermarkSettings, fmt: str) -> str:
+    stem = src.stem
+    if st.name_mode == "prefix":
+        stem = f"{st.name_prefix}{stem}"
+    elif st.name_mode == "suffix":
+        stem = f"{stem}{st.name_suffix}"
+    ext = ".png" if fmt.upper() == "PNG" else ".jpg"
+    return stem + ext
+
+
+def file_size(p: Path) -> int:
+    try:
+        return os.stat(p).st_size
+    except OSError:
+        return 0
+
+
+class ExportSignals(QObject):
+    finished = Signal(str)  # "" on success, otherwise "<file>: <error>"
+
+
+class ExportWriter(threading.Thread):
+    # single disk-writer thread: workers hand over encoded bytes and move on to the next image,
+    # so write latency (HDD / network share) overlaps with decode/compose/encode
+    def __init__(self, signals: ExportSignals):
+        super().__init__(daemon=True)
+        self.jobs: "queue.Queue[Optional[Tuple[str, Path, bytes]]]" = queue.Queue(maxsize=16)  # bounds memory
+        self.signals = signals
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            name, dest, data = job
+            try:
+                dest.write_bytes(data)
+            except OSError as e:
+                self.signals.finished.emit(f"{name}: 保存失败 {e}")
+                continue
+            self.signals.finished.emit("")
+
+    def stop(self):
+        # only once every task of the run has reported: jobs queued after the sentinel are never written
+        self.jobs.put(None)
+
+
+class ExportTask(QRunnable):
+    # one source image: decode, compose, encode; everything stays in QImage so it can run off the GUI thread
+    def __init__(self, src: Path, dest: Path, st: WatermarkSettings, fmt: str,
+                 cancel: threading.Event, signals: ExportSignals, writer: ExportWriter):
+        super().__init__()
+        self.src = src
+        self.dest = dest
+        self.st = st
+        self.fmt = fmt
+        self.cancel = cancel
+        self.signals = signals
+        self.writer = writer
+
+    def run(self):
+        if self.cancel.is_set():
+            self.signals.finished.emit("")
+            return
+        try:
+            img, src_size = load_export_qimage(self.src, self.st)
+            if img is None:
+                raise RuntimeError("无法读取图片")
+            out_img = compose_image(img, self.st, src_size)
+            data = encode_qimage(out_img, self.fmt, self.st.jpeg_quality)
+            if data is None:
+                raise RuntimeError("编码失败")
+        except Exception as e:
+            self.signals.finished.emit(f"{self.src.name}: {e}")
+            return
+        job = (self.src.name, self.dest, data)
+        while True:
+            # bounded wait: a writer that has exited must not block this pool thread forever
+            try:
+                self.writer.jobs.put(job, timeout=0.5)
+                return  # writer reports completion
+            except queue.Full:
+                if not self.writer.is_alive():
+                    self.signals.finished.emit(f"{self.src.name}: 写入线程已停止")
+                    return
+
+
+class ExportRun(QObject):
+    # all state of one export batch; its own signals/writer/cancel flag, so completions from a
+    # cancelled earlier run can never be counted toward a newer one
+    progressed = Signal(int)  # images done so far, throttled to ~20 updates/s
+    allDone = Signal(object)  # self, once every task of this run has reported
+
+    def __init__(self, total: int, out_dir: Path, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.total = total
+        self.out_dir = out_dir
+        self.done = 0
+        self.errors: List[str] = []  # first EXPORT_ERRORS_SHOWN only; error_count has the total
+        self.error_count = 0
+        self.shown_at = 0.0  # time.monotonic() of the last progressed emit
+        self.cancel = threading.Event()
+        self.signals = ExportSignals(self)
+        self.signals.finished.connect(self.on_item_done)
+        self.writer = ExportWriter(self.signals)
+        self.writer.start()
+
+    def task(self, src: Path, dest: Path, st: WatermarkSettings, fmt: str) -> "ExportTask":
+        return ExportTask(src, dest, st, fmt, self.cancel, self.signals, self.writer)
+
+    def busy(self) -> bool:
+        return self.done < self.total or self.writer.is_alive()
+
+    def on_item_done(self, error: str):
+        if error:
+            self.error_count += 1
+            if len(self.errors) < EXPORT_ERRORS_SHOWN:
+                self.errors.append(error)
+        self.done += 1
+        if self.done < self.total:
+            # why: setValue on a modal QProgressDialog runs processEvents; ~20 updates/s is plenty
+            now = time.monotonic()
+            if now - self.shown_at >= 0.05:
+                self.shown_at = now
+                self.progressed.emit(self.done)
+            return
+        # every task has reported, so every job was already handed to (and written by) the writer
+        self.writer.stop()
+        self.allDone.emit(self)
+
+
 # -------- UI: Image list --------
 
+class ThumbSignals(QObject):
+    done = Signal(str, QImage)  # (path, thumb); thumb is null when decoding failed
+
+
+class ThumbTask(QRunnable):
+    # decode + scale off the GUI thread; Qt's decoders release the GIL
+    def __init__(self, path: Path, cache_dir: Path, signals: ThumbSignals):
+        super().__init__()
+        self.path = path
+        self.cache_dir = cache_dir
+        self.signals = signals
+
+    def run(self):
+        thumb = None
+        try:
+            thumb = load_cached_thumbnail(self.path, THUMB_SIZE, self.cache_dir)
+        finally:
+            # always report, or the row would stay in pending without an icon forever
+            self.signals.done.emit(str(self.path), thumb if thumb is not None else QImage())
+
+
+class ScanSignals(QObject):
+    found = Signal(list)  # batch of str paths
+
+
+class ScanTask(QRunnable):
+    # walks a dropped/imported folder off the GUI thread, streaming matches back in batches
+    BATCH = 256
+
+    def __init__(self, root: Path, signals: ScanSignals):
+        super().__init__()
+        self.root = root
+        self.signals = signals
+
+    def run(self):
+        batch: List[str] = []
+        for sp in scan_dir_images(str(self.root)):
+            batch.append(sp)
+            if len(batch) >= self.BATCH:
+                self.signals.found.emit(batch)
+                batch = []
+        if batch:
+            self.signals.found.emit(batch)
+
+
 class ImageListPanel(QListWidget):
-    filesChanged = Signal(list)
+    filesChanged = Signal(int)  # new list length; listeners read self.paths if they need it
 
     def __init__(self):
         super().__init__()
@@ -213,37 +732,82 @@ class ImageListPanel(QListWidget):
         self.setAcceptDrops(True)
         self.setDragDropMode(QListWidget.DragDropMode.NoDragDrop)
         self.paths: List[Path] = []
-
-    def add_images(self, new_paths: List[Path]):
-        existed = {str(p) for p in self.paths}
+        self.path_set: set = set()  # str paths, kept in sync with self.paths for O(1) dedupe
+        self.pending: Dict[str, QListWidgetItem] = {}  # items still waiting for a thumbnail
+        self.thumb_cache_dir = thumbs_dir()
+        prune_thumb_cache(self.thumb_cache_dir)
+        self.thumb_signals = ThumbSignals(self)
+        self.thumb_signals.done.connect(self.on_thumb_ready)
+        self.scan_signals = ScanSignals(self)
+        self.scan_signals.found.connect(self.on_scan_found)
+
+    def add_images(self, new_paths: Iterable[Path]):
         added = []
-        for p in new_paths:
-            sp = str(p)
-            if sp in existed:
-                continue
-            img = load_qimage(p)
-            if img is None:
-                continue
-            thumb = QPixmap.fromImage(img.scaled(THUMB_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation))
-            item = QListWidgetItem(QIcon(thumb), p.name)
-            item.setToolTip(sp)
-            self.addItem(item)
-            self.paths.append(p)
-            added.append(p)
+        pool = QThreadPool.globalInstance()
+        self.setUpdatesEnabled(False)  # one relayout for the whole batch, not one per addItem
+        try:
+            for p in new_paths:
+                sp = str(p)
+                if sp in self.path_set:
+                    continue
+                self.path_set.add(sp)
+                item = QListWidgetItem(p.name)
+                item.setToolTip(sp)
+                self.addItem(item)
+                self.paths.append(p)
+                self.pending[sp] = item
+                pool.start(ThumbTask(p, self.thumb_cache_dir, self.thumb_signals))
+                added.append(p)
+        finally:
+            self.setUpdatesEnabled(True)
         if added:
-            self.filesChanged.emit([str(p) for p in self.paths])
+            self.filesChanged.emit(len(self.paths))
+
+    def add_paths(self, paths: List[Path]):
+        # files are added right away; folders are walked by ScanTask and arrive via on_scan_found
+        pool = QThreadPool.globalInstance()
+        files = []
+        for p in paths:
+            if p.is_dir():
+                pool.start(ScanTask(p, self.scan_signals))
+            else:
+                files.append(p)
+        if files:
+            self.add_images(enumerate_images(files))
+
+    def on_scan_found(self, batch: List[str]):
+        self.add_images([Path(sp) for sp in batch])
+
+    def on_thumb_ready(self, sp: str, thumb: QImage):
+        item = self.pending.pop(sp, None)
+        if item is None:  # removed from the list meanwhile
+            return
+        if thumb.isNull():
+            # unreadable file: drop it, as the synchronous import used to
+            row = self.row(item)
+            self.takeItem(row)
+            self.path_set.discard(sp)
+            del self.paths[row]
+            self.filesChanged.emit(len(self.paths))
+            return
+        item.setIcon(QIcon(QPixmap.fromImage(thumb)))
 
     def remove_selected(self):
         rows = sorted({i.row() for i in self.selectedIndexes()}, reverse=True)
         for r in rows:
             self.takeItem(r)
+            self.pending.pop(str(self.paths[r]), None)
+            self.path_set.discard(str(self.paths[r]))
             del self.paths[r]
-        self.filesChanged.emit([str(p) for p in self.paths])
+        self.filesChanged.emit(len(self.paths))
 
     def clear_all(self):
         super().clear()
         self.paths = []
-        self.filesChanged.emit([])
+        self.path_set.clear()
+        self.pending.clear()
+        decode_preview.cache_clear()
+        self.filesChanged.emit(0)
 
     # drag & drop
     def dragEnterEvent(self, e: QDragEnterEvent):
@@ -252,9 +816,7 @@ class ImageListPanel(QListWidget):
 
     def dropEvent(self, e: QDropEvent):
         urls = e.mimeData().urls()
-        paths = [Path(u.toLocalFile()) for u in urls]
-        imgs = enumerate_images(paths)
-        self.add_images(imgs)
+        self.add_paths([Path(u.toLocalFile()) for u in urls])
 
 
 # -------- UI: Preview Canvas --------
@@ -264,144 +826,163 @@ class PreviewCanvas(QWidget):
 
     def __init__(self):
         super().__init__()
-        self.base_img: Optional[QImage] = None
-        self.base_pix: Optional[QPixmap] = None
+        self.base_img: Optional[QImage] = None  # kept as QImage: the whole paint path stays raster-side
+        self.src_size = QSize()  # full-resolution size; the watermark is rendered in these pixels
         self.scaled_rect: QRect = QRect()
         self.settings = WatermarkSettings()
         self.setMouseTracking(True)
         self.dragging = False
         self.drag_offset = QPointF(0, 0)  # why: to preserve pointer grab relative to wm center
-        self.cached_wm_pixmap: Optional[QPixmap] = None
+        self.cached_wm_img: Optional[QImage] = None
+        self.cached_wm_key: Optional[tuple] = None  # why: drag only moves pos_rel, keep the rendered layer
+        self.cached_scaled_img: Optional[QImage] = None  # base scaled to the current widget size
+        self.cached_scaled_key: Optional[tuple] = None
+        self.cached_scaled_fast = False
+        self.wm_full_img: Optional[QImage] = None  # layer at export resolution, shared by every preview size
+        self.wm_full_key: Optional[tuple] = None
+        # coalesce repaint requests: drags and slider scrubbing repaint at most once per frame (~16 ms)
+        self.repaint_timer = QTimer(self)
+        self.repaint_timer.setSingleShot(True)
+        self.repaint_timer.setInterval(16)
+        self.repaint_timer.timeout.connect(self.flush_update)
+        self.dirty_rect: Optional[QRect] = None  # drag-only damage; None means repaint everything
+        self.dirty_full = False
+        # FastTransformation while dragging; one smooth repaint once input pauses for 150 ms
+        self.fast_paint = False
+        self.smooth_timer = QTimer(self)
+        self.smooth_timer.setSingleShot(True)
+        self.smooth_timer.setInterval(150)
+        self.smooth_timer.timeout.connect(self.on_smooth_timeout)
         self.setMinimumSize(320, 240)
 
-    def set_image(self, img: Optional[QImage]):
+    def set_image(self, img: Optional[QImage], src_size: Optional[QSize] = None):
         self.base_img = img
-        self.base_pix = QPixmap.fromImage(img) if img is not None else None
+        self.cached_scaled_img = None
+        self.cached_scaled_key = None
+        self.src_size = src_size if src_size is not None and src_size.isValid() else (img.size() if img else QSize())
         self.update()
 
     def set_settings(self, st: WatermarkSettings):
-        self.settings = st
-        self.cached_wm_pixmap = None
+        self.settings = st  # build_watermark_image decides staleness by comparing cache keys
+        self.schedule_update()
+
+    def schedule_update(self, rect: Optional[QRect] = None):
+        if rect is None:
+            self.dirty_full = True
+        else:
+            self.dirty_rect = rect if self.dirty_rect is None else self.dirty_rect.united(rect)
+        if not self.repaint_timer.isActive():
+            self.repaint_timer.start()
+
+    def flush_update(self):
+        if self.dirty_full or self.dirty_rect is None:
+            self.update()
+        else:
+            self.update(self.dirty_rect.adjusted(-2, -2, 2, 2))  # margin for antialiased edges
+        self.dirty_rect = None
+        self.dirty_full = False
+
+    def on_smooth_timeout(self):
+        self.fast_paint = False
         self.update()
 
     def sizeHint(self) -> QSize:
         return QSize(800, 600)
 
     def compute_scaled_rect(self) -> QRect:
-        if not self.base_pix:
+        if not self.base_img:
             return QRect()
         avail = self.rect()
-        pix = self.base_pix
-        scaled = pix.scaled(avail.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        x = (avail.width() - scaled.width()) // 2
-        y = (avail.height() - scaled.height()) // 2
-        return QRect(QPoint(x, y), scaled.size())
-
-    def build_text_watermark(self, target_px: int) -> QPixmap:
-        st = self.settings
-        font = QFont(st.font_family, st.font_point)
-        font.setBold(st.font_bold)
-        font.setItalic(st.font_italic)
-        # measure text
-        tmp_img = QImage(1, 1, QImage.Format.Format_ARGB32)
-        tmp_img.fill(Qt.transparent)
-        p = QPainter(tmp_img)
-        p.setFont(font)
-        metrics = p.fontMetrics()
-        br = metrics.boundingRect(st.text)
-        p.end()
-        w = max(4, br.width() + 16)
-        h = max(4, br.height() + 16)
-        # draw text with optional shadow
-        img = QImage(w, h, QImage.Format.Format_ARGB32)
-        img.fill(Qt.transparent)
-        painter = QPainter(img)
-        painter.setRenderHint(QPainter.Antialiasing, True)
-        painter.setFont(font)
-        col = qcolor_from_rgba_str(st.color_rgba)
-        if st.shadow:
-            shadow = QColor(0, 0, 0, int(0.5 * st.opacity * 2.55))
-            painter.setPen(shadow)
-            painter.drawText(9, h - metrics.descent() - 7, st.text)
-        painter.setPen(col)
-        painter.drawText(8, h - metrics.descent() - 8, st.text)
-        painter.end()
-        pix = QPixmap.fromImage(img)
-        # scale text if needed relative to target pixels (no-op here font point governs size)
-        return pix
+        size = self.base_img.size().scaled(avail.size(), Qt.KeepAspectRatio)
+        x = (avail.width() - size.width()) // 2
+        y = (avail.height() - size.height()) // 2
+        return QRect(QPoint(x, y), size)
 
-    def build_image_watermark(self, base_size: QSize) -> Optional[QPixmap]:
-        st = self.settings
-        if not st.image_path or not Path(st.image_path).exists():
-            return None
-        wm_img = load_qimage(Path(st.image_path))
-        if wm_img is None or wm_img.isNull():
-            return None
-        # scale relative to shorter side of base image
-        short_side = min(base_size.width(), base_size.height())
-        scale_px = max(1, int(short_side * (st.image_scale_pct / 100.0)))
-        wm_pix = QPixmap.fromImage(wm_img)
-        ratio = wm_pix.width() / wm_pix.height()
-        if wm_pix.width() >= wm_pix.height():
-            target_w = scale_px
-            target_h = int(target_w / ratio)
-        else:
-            target_h = scale_px
-            target_w = int(target_h * ratio)
-        scaled = wm_pix.scaled(QSize(target_w, target_h), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        return scaled
-
-    def build_watermark_pixmap(self, base_px_size: QSize) -> Optional[QPixmap]:
-        if self.cached_wm_pixmap:
-            return self.cached_wm_pixmap
+    def wm_cache_key(self, base_px_size: QSize) -> tuple:
+        # position and opacity are applied at draw time, so they stay out of the key
         st = self.settings
         if st.wm_type == "text":
-            pix = self.build_text_watermark(target_px=min(base_px_size.width(), base_px_size.height()))
+            key: tuple = ("text", st.text, st.font_family, st.font_point, st.font_bold, st.font_italic,
+                          st.color_rgba, st.shadow, st.opacity if st.shadow else None)
         else:
-            pix = self.build_image_watermark(base_px_size)
-            if pix is None:
-                return None
-        # rotation
-        if abs(st.rotation) > 0.01:
-            tr = QTransform()
-            tr.rotate(st.rotation)
-            pix = pix.transformed(tr, Qt.SmoothTransformation)
-        self.cached_wm_pixmap = pix
-        return pix
-
-    def wm_rect_on_scaled(self) -> Optional[QRect]:
-        if not self.base_pix:
-            return None
-        scaled_rect = self.compute_scaled_rect()
-        wm_pix = self.build_watermark_pixmap(scaled_rect.size())
-        if wm_pix is None:
+            key = ("image", st.image_path, st.image_scale_pct, base_px_size.width(), base_px_size.height())
+        return key
+
+    def scaled_base(self, size: QSize) -> QImage:
+        # rescale only when the image or widget size changes; a drag reuses the cached frame
+        if size == self.base_img.size():
+            return self.base_img
+        key = (self.base_img.cacheKey(), size.width(), size.height())
+        # a fast (drag-time) scale is upgraded once painting goes smooth again
+        if key != self.cached_scaled_key or (self.cached_scaled_fast and not self.fast_paint):
+            mode = Qt.FastTransformation if self.fast_paint else Qt.SmoothTransformation
+            self.cached_scaled_img = self.base_img.scaled(size, Qt.KeepAspectRatio, mode)
+            self.cached_scaled_key = key
+            self.cached_scaled_fast = self.fast_paint
+        return self.cached_scaled_img
+
+    def preview_scale(self, disp_size: QSize) -> float:
+        return disp_size.width() / max(1, self.src_size.width())
+
+    def build_watermark_image(self, disp_size: QSize) -> Optional[QImage]:
+        # render once at export resolution (WYSIWYG), then downscale that layer for the preview
+        key = self.wm_cache_key(self.src_size)
+        # the display layer depends on disp/src scale, so src_size belongs in this key even when key omits it
+        disp_key = (key, self.src_size.width(), self.src_size.height(), disp_size.width(), disp_size.height())
+        if self.cached_wm_img and disp_key == self.cached_wm_key:
+            return self.cached_wm_img
+        if key != self.wm_full_key:
+            self.wm_full_img = render_watermark(self.settings, self.src_size)
+            self.wm_full_key = key
+        img = self.wm_full_img
+        if img is None:
             return None
+        scale = self.preview_scale(disp_size)
+        w = max(1, round(img.width() * scale))
+        h = max(1, round(img.height() * scale))
+        # rotation is applied by the painter (see watermark_transform)
+        scaled = img.scaled(w, h, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        self.cached_wm_img = scaled
+        self.cached_wm_key = disp_key
+        return scaled
+
+    def wm_transform_on_scaled(self, scaled_rect: QRect, wm_img: QImage) -> QTransform:
         st = self.settings
         cx = scaled_rect.x() + st.pos_rel[0] * scaled_rect.width()
         cy = scaled_rect.y() + st.pos_rel[1] * scaled_rect.height()
-        x = int(cx - wm_pix.width() / 2)
-        y = int(cy - wm_pix.height() / 2)
-        return QRect(x, y, wm_pix.width(), wm_pix.height())
+        return watermark_transform(cx, cy, wm_img.width(), wm_img.height(), st.rotation)
+
+    def wm_rect_on_scaled(self, scaled_rect: Optional[QRect] = None) -> Optional[QRect]:
+        if not self.base_img:
+            return None
+        if scaled_rect is None:
+            scaled_rect = self.compute_scaled_rect()
+        wm_img = self.build_watermark_image(scaled_rect.size())
+        if wm_img is None:
+            return None
+        # axis-aligned bbox of the rotated watermark, mapped in C++
+        t = self.wm_transform_on_scaled(scaled_rect, wm_img)
+        return t.mapRect(QRectF(wm_img.rect())).toAlignedRect()
 
     def paintEvent(self, e: QPaintEvent):
         painter = QPainter(self)
         painter.fillRect(self.rect(), self.palette().base())
-        if not self.base_pix:
+        if not self.base_img:
             painter.drawText(self.rect(), Qt.AlignCenter, "导入图片以预览")
             painter.end()
             return
         # draw scaled base
         self.scaled_rect = self.compute_scaled_rect()
-        scaled_pix = self.base_pix.scaled(self.scaled_rect.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        painter.drawPixmap(self.scaled_rect.topLeft(), scaled_pix)
+        scaled_img = self.scaled_base(self.scaled_rect.size())
+        painter.drawImage(self.scaled_rect.topLeft(), scaled_img)
         # draw watermark
-        wm_pix = self.build_watermark_pixmap(self.scaled_rect.size())
-        if wm_pix:
+        wm_img = self.build_watermark_image(self.scaled_rect.size())
+        if wm_img and self.settings.opacity > 0:
             st = self.settings
-            rect = self.wm_rect_on_scaled()
-            if rect:
-                painter.setOpacity(max(0.0, min(1.0, st.opacity / 100.0)))
-                painter.drawPixmap(rect.topLeft(), wm_pix)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, not self.fast_paint)
+            painter.setTransform(self.wm_transform_on_scaled(self.scaled_rect, wm_img))
+            painter.setOpacity(max(0.0, min(1.0, st.opacity / 100.0)))
+            painter.drawImage(0, 0, wm_img)
         painter.end()
 
     def mousePressEvent(self, e):
@@ -413,7 +994,7 @@ class PreviewCanvas(QWidget):
                 self.drag_offset = QPointF(e.position().x() - c.x(), e.position().y() - c.y())
 
     def mouseMoveEvent(self, e):
-        if self.dragging and self.base_pix:
+        if self.dragging and self.base_img:
             sr = self.compute_scaled_rect()
             cx = e.position().x() - self.drag_offset.x()
             cy = e.position().y() - self.drag_offset.y()
@@ -422,12 +1003,23 @@ class PreviewCanvas(QWidget):
             cy = max(sr.top(), min(sr.bottom(), cy))
             x_rel = (cx - sr.left()) / max(1, sr.width())
             y_rel = (cy - sr.top()) / max(1, sr.height())
+            old_rect = self.wm_rect_on_scaled(sr)
             self.settings.pos_rel = (float(x_rel), float(y_rel))
-            self.cached_wm_pixmap = None
-            self.update()
+            new_rect = self.wm_rect_on_scaled(sr)
+            self.fast_paint = True
+            self.smooth_timer.start()
+            # only the watermark footprint (old + new position) needs repainting
+            if old_rect is not None and new_rect is not None:
+                self.schedule_update(old_rect.united(new_rect))
+            else:
+                self.schedule_update()
             self.positionChanged.emit(self.settings.pos_rel)
 
     def mouseReleaseEvent(self, e):
+        if self.dragging and self.fast_paint:
+            # drag ended: settle to the smooth frame now instead of waiting for the idle timer
+            self.smooth_timer.stop()
+            self.on_smooth_timeout()
         self.dragging = False
 
 
@@ -439,10 +1031,12 @@ class ControlPanel(QWidget):
     addFilesRequested = Signal()
     addFolderRequested = Signal()
 
+    RESIZE_MODES = ["none", "width", "height", "percent"]  # cmb_resize order
+    NAME_MODES = ["original", "prefix", "suffix"]  # cmb_name order
+
     def __init__(self):
         super().__init__()
         self.st = WatermarkSettings()
-        self.font_db = QFontDatabase()
 
         root = QVBoxLayout(self)
         root.setAlignment(Qt.AlignTop)
@@ -465,7 +1059,6 @@ class ControlPanel(QWidget):
         self.rb_text = QRadioButton("文本")
         self.rb_img = QRadioButton("图片")
         self.rb_text.setChecked(True)
-        self.rb_text.toggled.connect(self.on_type_changed)
         ly_type.addWidget(self.rb_text)
         ly_type.addWidget(self.rb_img)
         grp_type.setLayout(ly_type)
@@ -476,7 +1069,7 @@ class ControlPanel(QWidget):
         form_t = QFormLayout()
         self.ed_text = QLineEdit(self.st.text)
         self.cmb_font = QComboBox()
-        self.cmb_font.addItems(self.font_db.families())
+        self.cmb_font.setModel(QStringListModel(list(font_families()), self.cmb_font))
         # default select
         idx = self.cmb_font.findText(self.st.font_family)
         if idx >= 0: self.cmb_font.setCurrentIndex(idx)
@@ -640,36 +1233,44 @@ class ControlPanel(QWidget):
 
         root.addStretch(1)
 
-        # signal wiring
-        for w in [
-            self.ed_text, self.cmb_font, self.spin_font,
-            self.chk_bold, self.chk_italic, self.chk_shadow,
-            self.sld_opacity, self.spin_rotation, self.ed_img,
-            self.sld_img_scale, self.cmb_fmt, self.sld_quality,
-            self.cmb_resize, self.ed_resize, self.rb_text, self.rb_img,
-            self.ed_out, self.cmb_name, self.ed_prefix, self.ed_suffix
-        ]:
-            if isinstance(w, (QLineEdit,)):
-                w.textChanged.connect(self.emit_settings)
-            elif isinstance(w, (QComboBox,)):
-                w.currentIndexChanged.connect(self.emit_settings)
-            elif isinstance(w, (QCheckBox, QRadioButton)):
-                w.toggled.connect(self.emit_settings)
-            elif isinstance(w, (QSpinBox,)):
-                w.valueChanged.connect(self.emit_settings)
-            elif isinstance(w, (QSlider,)):
-                w.valueChanged.connect(self.emit_settings)
+        # signal wiring: each widget writes only its own field (no full re-read per keystroke)
+        def bind(signal, name: str, conv=lambda v: v):
+            signal.connect(lambda v: self.set_field(name, conv(v)))
+
+        bind(self.rb_text.toggled, "wm_type", lambda on: "text" if on else "image")
+        bind(self.ed_text.textChanged, "text")
+        bind(self.cmb_font.currentTextChanged, "font_family")
+        bind(self.spin_font.valueChanged, "font_point")
+        bind(self.chk_bold.toggled, "font_bold")
+        bind(self.chk_italic.toggled, "font_italic")
+        bind(self.chk_shadow.toggled, "shadow")
+        bind(self.sld_opacity.valueChanged, "opacity")
+        bind(self.spin_rotation.valueChanged, "rotation", float)
+        bind(self.ed_img.textChanged, "image_path")
+        bind(self.sld_img_scale.valueChanged, "image_scale_pct")
+        bind(self.ed_out.textChanged, "out_dir")
+        bind(self.cmb_fmt.currentTextChanged, "out_format")
+        bind(self.sld_quality.valueChanged, "jpeg_quality")
+        bind(self.cmb_resize.currentIndexChanged, "resize_mode", lambda i: self.RESIZE_MODES[i])
+        bind(self.ed_resize.textChanged, "resize_value", lambda t: int(t or "0"))
+        bind(self.cmb_name.currentIndexChanged, "name_mode", lambda i: self.NAME_MODES[i])
+        bind(self.ed_prefix.textChanged, "name_prefix")
+        bind(self.ed_suffix.textChanged, "name_suffix")
 
         self.sld_quality.valueChanged.connect(lambda v: self.lbl_quality.setText(str(v)))
         self.cmb_fmt.currentTextChanged.connect(self.toggle_quality_enabled)
         self.toggle_quality_enabled(self.cmb_fmt.currentText())
 
+        self.cmb_tpl.currentTextChanged.connect(self.load_template)  # connected once; reload must not stack these
         self.reload_templates_combo()
         # try load last settings
         self.try_load_last()
 
-    def on_type_changed(self, checked: bool):
-        self.emit_settings()
+    def set_field(self, name: str, value):
+        if getattr(self.st, name) == value:  # why: sync_ui_from_settings echoes every field back
+            return
+        setattr(self.st, name, value)
+        self.settingsChanged.emit(self.st)
 
     def toggle_quality_enabled(self, fmt: str):
         enabled = (fmt.upper() == "JPEG")
@@ -682,7 +1283,7 @@ class ControlPanel(QWidget):
         if c.isValid():
             self.st.color_rgba = c.name(QColor.HexArgb)
             self.lbl_color.setText(self.st.color_rgba)
-            self.emit_settings()
+            self.settingsChanged.emit(self.st)
 
     def pick_image(self):
         fn, _ = QFileDialog.getOpenFileName(self, "选择水印图片", "", "Images (*.png *.jpg *.jpeg *.bmp *.tif *.tiff)")
@@ -702,10 +1303,10 @@ class ControlPanel(QWidget):
         rx = min(1.0, max(0.0, rx))
         ry = min(1.0, max(0.0, ry))
         self.st.pos_rel = (rx, ry)
-        self.emit_settings()
+        self.settingsChanged.emit(self.st)
 
     def emit_settings(self):
-        # gather UI -> settings
+        # full gather UI -> settings; interactive edits go through set_field instead
         st = self.st
         st.wm_type = "text" if self.rb_text.isChecked() else "image"
         st.text = self.ed_text.text()
@@ -722,23 +1323,24 @@ class ControlPanel(QWidget):
         st.out_format = self.cmb_fmt.currentText()
         st.jpeg_quality = self.sld_quality.value()
         idx_resize = self.cmb_resize.currentIndex()
-        st.resize_mode = ["none", "width", "height", "percent"][idx_resize]
+        st.resize_mode = self.RESIZE_MODES[idx_resize]
         st.resize_value = int(self.ed_resize.text() or "0")
         nm_idx = self.cmb_name.currentIndex()
-        st.name_mode = ["original", "prefix", "suffix"][nm_idx]
+        st.name_mode = self.NAME_MODES[nm_idx]
         st.name_prefix = self.ed_prefix.text()
         st.name_suffix = self.ed_suffix.text()
         self.settingsChanged.emit(st)
 
     # templates
     def reload_templates_combo(self):
+        # why: refilling the combo must not load whichever template lands at index 0
+        self.cmb_tpl.blockSignals(True)
         self.cmb_tpl.clear()
-        tdir = templates_dir()
-        names = [p.stem for p in tdir.glob("*.json")]
-        self.cmb_tpl.addItems(sorted(names))
+        names = sorted(p.stem for p in templates_dir().iterdir() if p.suffix == ".json")
+        self.cmb_tpl.addItems(names)
         if self.cmb_tpl.count() > 0:
             self.cmb_tpl.setCurrentIndex(0)
-            self.cmb_tpl.currentTextChanged.connect(self.load_template)
+        self.cmb_tpl.blockSignals(False)
 
     def save_template(self):
         name, ok = QFileDialog.getSaveFileName(self, "保存模板为…", str(templates_dir() / "template.json"),
@@ -747,8 +1349,7 @@ class ControlPanel(QWidget):
             return
         self.emit_settings()
         try:
-            with open(name, "w", encoding="utf-8") as f:
-                json.dump(self.st.to_dict(), f, ensure_ascii=False, indent=2)
+            write_text_atomic(Path(name), json.dumps(self.st.to_dict(), ensure_ascii=False, indent=2))
         except Exception as e:
             QMessageBox.critical(self, "错误", f"保存失败：\n{e}")
             return
@@ -794,9 +1395,9 @@ class ControlPanel(QWidget):
         self.ed_out.setText(st.out_dir)
         self.cmb_fmt.setCurrentText(st.out_format)
         self.sld_quality.setValue(st.jpeg_quality)
-        self.cmb_resize.setCurrentIndex(["none", "width", "height", "percent"].index(st.resize_mode))
+        self.cmb_resize.setCurrentIndex(self.RESIZE_MODES.index(st.resize_mode))
         self.ed_resize.setText(str(st.resize_value or ""))
-        self.cmb_name.setCurrentIndex(["original", "prefix", "suffix"].index(st.name_mode))
+        self.cmb_name.setCurrentIndex(self.NAME_MODES.index(st.name_mode))
         self.ed_prefix.setText(st.name_prefix)
         self.ed_suffix.setText(st.name_suffix)
         self.toggle_quality_enabled(st.out_format)
@@ -826,6 +1427,13 @@ class MainWindow(QMainWindow):
         self.images = ImageListPanel()
         self.preview = PreviewCanvas()
         self.controls = ControlPanel()
+        self.export_pool = QThreadPool(self)  # why: dedicated pool, thumbnails keep using the global one
+        self.export_run: Optional[ExportRun] = None  # batch in flight (or still draining after cancel)
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(1000)
+        self.save_timer.timeout.connect(self.save_last_settings)
+        self.last_saved_json: Optional[str] = None
 
         self.controls.settingsChanged.connect(self.on_settings_changed)
         self.controls.exportRequested.connect(self.on_export)
@@ -878,9 +1486,7 @@ class MainWindow(QMainWindow):
 
     def dropEvent(self, e: QDropEvent):
         urls = e.mimeData().urls()
-        paths = [Path(u.toLocalFile()) for u in urls]
-        imgs = enumerate_images(paths)
-        self.images.add_images(imgs)
+        self.images.add_paths([Path(u.toLocalFile()) for u in urls])
         self.ensure_preview_loaded()
 
     def ensure_preview_loaded(self):
@@ -894,16 +1500,31 @@ class MainWindow(QMainWindow):
         if row < 0 or row >= len(self.images.paths):
             self.preview.set_image(None)
             return
-        img = load_qimage(self.images.paths[row])
-        self.preview.set_image(img)
+        path = self.images.paths[row]
+        img = decode_preview_path(path)
+        # header-only read: the preview copy may be downscaled, the watermark is sized for the original
+        self.preview.set_image(img, QImageReader(str(path)).size())
 
     def on_settings_changed(self, st: WatermarkSettings):
         self.preview.set_settings(st)
-        # persist last
+        # persist last, debounced: slider scrubbing fires this on every tick
+        self.save_timer.start()
+
+    def save_last_settings(self):
+        text = json.dumps(self.preview.settings.to_dict(), ensure_ascii=False)
+        if text == self.last_saved_json:  # e.g. a slider dragged away and back
+            return
         try:
-            last_settings_path().write_text(json.dumps(st.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+            write_text_atomic(last_settings_path(), text)
         except Exception:
-            pass
+            return
+        self.last_saved_json = text
+
+    def closeEvent(self, e):
+        if self.save_timer.isActive():
+            self.save_timer.stop()
+            self.save_last_settings()
+        super().closeEvent(e)
 
     def on_preview_pos_changed(self, rel: tuple):
         # nothing to do settings already updated by canvas
@@ -918,69 +1539,15 @@ class MainWindow(QMainWindow):
     def on_add_folder(self):
         d = QFileDialog.getExistingDirectory(self, "导入文件夹")
         if d:
-            imgs = enumerate_images([Path(d)])
-            self.images.add_images(imgs)
-            self.ensure_preview_loaded()
-
-    # --- export pipeline ---
-
-    def build_watermark_layer(self, base_size: QSize, st: WatermarkSettings) -> Optional[QPixmap]:
-        canvas = PreviewCanvas()  # reuse logic why: single source of truth for wm rendering
-        canvas.settings = st
-        # Build wm pixmap for full-size base (not scaled preview)
-        wm = canvas.build_watermark_pixmap(base_size)
-        return wm
-
-    def compose_image(self, src_img: QImage, st: WatermarkSettings) -> QImage:
-        base = src_img
-        # optional resize
-        if st.resize_mode != "none" and st.resize_value > 0:
-            w, h = base.width(), base.height()
-            if st.resize_mode == "width" and st.resize_value < w:
-                new_w = st.resize_value
-                new_h = int(h * (new_w / w))
-                base = base.scaled(new_w, new_h, Qt.IgnoreAspectRatio if new_h == 0 else Qt.KeepAspectRatio,
-                                   Qt.SmoothTransformation)
-            elif st.resize_mode == "height" and st.resize_value < h:
-                new_h = st.resize_value
-                new_w = int(w * (new_h / h))
-                base = base.scaled(new_w, new_h, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            elif st.resize_mode == "percent":
-                scale = max(1, st.resize_value) / 100.0
-                base = base.scaled(int(w * scale), int(h * scale), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-        # watermark
-        wm = self.build_watermark_layer(base.size(), st)
-        if wm is None:
-            return base
-
-        # compute draw position
-        painter = QPainter()
-        out = QImage(base.size(), QImage.Format.Format_ARGB32)
-        out.fill(Qt.transparent)
-        painter.begin(out)
-        painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
-        painter.drawImage(0, 0, base)
-        cx = st.pos_rel[0] * base.width()
-        cy = st.pos_rel[1] * base.height()
-        x = int(cx - wm.width() / 2)
-        y = int(cy - wm.height() / 2)
-        painter.setOpacity(max(0.0, min(1.0, st.opacity / 100.0)))
-        painter.drawPixmap(x, y, wm)
-        painter.end()
-        return out
-
-    def compute_out_name(self, src: Path, st: WatermarkSettings, fmt: str) -> str:
-        stem = src.stem
-        if st.name_mode == "prefix":
-            stem = f"{st.name_prefix}{stem}"
-        elif st.name_mode == "suffix":
-            stem = f"{stem}{st.name_suffix}"
-        ext = ".png" if fmt.upper() == "PNG" else ".jpg"
-        return stem + ext
+            self.images.add_paths([Path(d)])  # preview is picked once the first batch lands (filesChanged)
 
     def on_export(self):
         st = self.preview.settings
+        # a cancelled run keeps draining in the background; let it finish before starting another
+        run = self.export_run
+        if self.export_pool.activeThreadCount() > 0 or (run is not None and run.busy()):
+            QMessageBox.warning(self, "提示", "上一次导出仍在结束中，请稍候再试。")
+            return
         # validations
         if len(self.images.paths) == 0:
             QMessageBox.warning(self, "提示", "请先导入图片。")
@@ -992,7 +1559,8 @@ class MainWindow(QMainWindow):
         out_dir.mkdir(parents=True, exist_ok=True)
 
         # forbid exporting to source directories by default
-        src_dirs = {p.parent.resolve() for p in self.images.paths}
+        # resolve each distinct folder once, not once per file (a batch usually shares a few folders)
+        src_dirs = {d.resolve() for d in {p.parent for p in self.images.paths}}
         if out_dir.resolve() in src_dirs:
             QMessageBox.warning(self, "提示", "为防覆盖，禁止导出到原图所在目录，请选择其他目录。")
             return
@@ -1006,35 +1574,36 @@ class MainWindow(QMainWindow):
             return
 
         fmt = st.out_format.upper()
-        errors = []
-        progress = QProgressDialog("正在导出…", "取消", 0, len(self.images.paths), self)
+        # snapshot: the canvas keeps mutating pos_rel while workers run
+        st = replace(st)
+        total = len(self.images.paths)
+        run = ExportRun(total, out_dir, self)
+        progress = QProgressDialog("正在导出…", "取消", 0, total, self)
         progress.setWindowModality(Qt.WindowModal)
         progress.setMinimumDuration(0)
-
-        for i, src in enumerate(self.images.paths):
-            progress.setValue(i)
-            progress.setLabelText(f"处理：{src.name}")
-            QApplication.processEvents()
-            if progress.wasCanceled():
-                break
-            try:
-                img = load_qimage(src)
-                if img is None:
-                    raise RuntimeError("无法读取图片")
-                out_img = self.compose_image(img, st)
-                out_name = self.compute_out_name(src, st, fmt)
-                dest = out_dir / out_name
-                if not save_qimage(out_img, dest, fmt, st.jpeg_quality):
-                    raise RuntimeError("保存失败")
-            except Exception as e:
-                errors.append(f"{src.name}: {e}")
-        progress.setValue(len(self.images.paths))
-
+        progress.canceled.connect(run.cancel.set)
+        run.progressed.connect(lambda n: None if run.cancel.is_set() else progress.setValue(n))
+        run.allDone.connect(lambda r: self.on_export_finished(r, progress))
+        self.export_run = run
+
+        # largest files first: the pool then finishes on small jobs instead of one straggler
+        for src in sorted(self.images.paths, key=file_size, reverse=True):
+            dest = out_dir / compute_out_name(src, st, fmt)
+            self.export_pool.start(run.task(src, dest, st, fmt))
+
+    def on_export_finished(self, run: ExportRun, progress: QProgressDialog):
+        if not run.cancel.is_set():
+            progress.setValue(run.total)
+        progress.deleteLater()
+        if self.export_run is run:
+            self.export_run = None
+        run.deleteLater()
+        errors = run.errors
         if errors:
-            QMessageBox.warning(self, "完成但有错误",
-                                "以下文件失败：\n" + "\n".join(errors[:20]) + ("\n..." if len(errors) > 20 else ""))
+            more = "\n..." if run.error_count > len(errors) else ""
+            QMessageBox.warning(self, "完成但有错误", "以下文件失败：\n" + "\n".join(errors) + more)
         else:
-            QMessageBox.information(self, "完成", f"已导出到：\n{out_dir}")
+            QMessageBox.information(self, "完成", f"已导出到：\n{run.out_dir}")
 
 
 # -------- entry --------
@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+pytest.importorskip("PySide6")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PySide6.QtCore import QSize  # noqa: E402
+from PySide6.QtGui import QImage  # noqa: E402
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+import studio_app  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+def make_canvas(src_size: QSize) -> studio_app.PreviewCanvas:
+    canvas = studio_app.PreviewCanvas()
+    canvas.set_settings(studio_app.WatermarkSettings(wm_type="text", text="Hello WM", font_point=36))
+    # a small stand-in image: only src_size drives the watermark scale
+    img = QImage(300, 200, QImage.Format.Format_RGB32)
+    img.fill(0)
+    canvas.set_image(img, src_size)
+    return canvas
+
+
+def test_text_layer_rescaled_when_switching_source_resolution(app):
+    disp = QSize(600, 400)
+    canvas = make_canvas(QSize(6000, 4000))
+    large = canvas.build_watermark_image(disp)
+
+    img = QImage(300, 200, QImage.Format.Format_RGB32)
+    img.fill(0)
+    canvas.set_image(img, QSize(1200, 800))  # same display size, 5x fewer source pixels
+    switched = canvas.build_watermark_image(disp)
+
+    fresh = make_canvas(QSize(1200, 800)).build_watermark_image(disp)
+    assert switched.size() == fresh.size()
+    assert switched.width() > large.width()
+
+
+def test_prune_thumb_cache_keeps_most_recent(tmp_path):
+    for i in range(5):
+        f = tmp_path / f"{i}.png"
+        f.write_bytes(b"x")
+        os.utime(f, (1000 + i, 1000 + i))
+    studio_app.prune_thumb_cache(tmp_path, max_files=2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["3.png", "4.png"]
+
+
+def test_export_runs_count_only_their_own_completions(app, tmp_path):
+    old = studio_app.ExportRun(2, tmp_path)
+    new = studio_app.ExportRun(1, tmp_path)
+    finished = []
+    new.allDone.connect(finished.append)
+    old.signals.finished.emit("")  # a late completion from a cancelled run
+    assert new.done == 0 and not finished
+    new.signals.finished.emit("")
+    assert finished == [new]
+    old.signals.finished.emit("")
+    for run in (old, new):
+        run.writer.join(timeout=5)
+        assert not run.busy()
+
+
+def test_export_task_does_not_block_on_a_stopped_writer(app, tmp_path):
+    signals = studio_app.ExportSignals()
+    errors = []
+    signals.finished.connect(errors.append)
+    writer = studio_app.ExportWriter(signals)  # never started: behaves like one that already exited
+    for i in range(writer.jobs.maxsize):
+        writer.jobs.put(("x", tmp_path / f"{i}", b""))
+    src = tmp_path / "src.png"
+    img = QImage(8, 8, QImage.Format.Format_RGB32)
+    img.fill(0)
+    img.save(str(src))
+    st = studio_app.WatermarkSettings(wm_type="text", text="x")
+    task = studio_app.ExportTask(src, tmp_path / "out.png", st, "PNG", threading.Event(), signals, writer)
+    task.run()  # must return instead of hanging in jobs.put
+    assert len(errors) == 1 and errors[0].startswith("src.png")
+
+
+def test_thumbnail_survives_failing_cache_write(app, tmp_path, monkeypatch):
+    src = tmp_path / "a.png"
+    img = QImage(64, 32, QImage.Format.Format_RGB32)
+    img.fill(0)
+    img.save(str(src))
+    cache_dir = tmp_path / "thumbs"
+    cache_dir.mkdir()
+
+    def locked(*args):
+        raise PermissionError("target in use")
+
+    monkeypatch.setattr(studio_app.os, "replace", locked)
+    thumb = studio_app.load_cached_thumbnail(src, QSize(16, 16), cache_dir)
+    assert thumb is not None and not thumb.isNull()
+    assert list(cache_dir.iterdir()) == []  # no stray .tmp left behind